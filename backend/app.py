@@ -4,12 +4,23 @@ Uses Claude Sonnet with 18 labeled examples for high accuracy
 Supports PDF, DOCX, TXT files up to 50MB
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import anthropic
+import bisect
+import gzip
+import hashlib
 import json
+import mmap
 import os
+import re
+import struct
 import tempfile
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+from collections.abc import Sequence
 
 # Check for optional dependencies
 try:
@@ -26,9 +37,16 @@ except ImportError:
     DOCX_SUPPORT = False
     print("[WARNING] python-docx not installed. DOCX support disabled.")
 
+try:
+    import numpy as np
+    CLASSIFIER_SUPPORT = True
+except ImportError:
+    CLASSIFIER_SUPPORT = False
+    print("[WARNING] numpy not installed. Local classifier disabled.")
+
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
-CORS(app)
+CORS(app, expose_headers=['X-Total-Matching'])
 
 @app.errorhandler(413)
 def request_entity_too_large(error):
@@ -38,6 +56,29 @@ def request_entity_too_large(error):
 # CONFIGURATION
 # ============================================
 ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY", "YOUR_API_KEY_HERE")
+
+# Local classifier: snippets up to LOCAL_CLASSIFIER_MAX_CHARS are classified
+# offline and only sent to Claude when confidence is below the threshold
+LOCAL_CLASSIFIER_THRESHOLD = float(os.environ.get("LOCAL_CLASSIFIER_THRESHOLD", "0.75"))
+LOCAL_CLASSIFIER_MAX_CHARS = 3000
+
+DATA_DIR = os.environ.get("CLINICAL_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+CLASSIFIER_MODEL_PATH = os.path.join(DATA_DIR, "local_classifier.npz")
+COMPONENT_CORPUS_PATH = os.path.join(DATA_DIR, "component_corpus.jsonl")
+COMPONENT_CORPUS_MAX = 20000  # unique components kept for retraining
+
+# Stored upload results, retrieved in pages via /api/results/<result_id>
+RESULTS_DIR = os.path.join(DATA_DIR, "results")
+RESULTS_MAX_COUNT = 200
+RESULTS_CACHE_SIZE = 8
+RESULTS_DEFAULT_PER_PAGE = 50
+RESULTS_MAX_PER_PAGE = 500
+
+# Cache of normalized PDF pages; bump EXTRACTOR_VERSION whenever
+# extract_text_from_pdf changes its output so stale entries are not reused
+EXTRACTOR_VERSION = 1
+EXTRACTION_CACHE_DIR = os.path.join(DATA_DIR, "extraction_cache")
+EXTRACTION_CACHE_MAX_BYTES = int(os.environ.get("EXTRACTION_CACHE_MAX_MB", "500")) * 1024 * 1024
 # ============================================
 
 client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
@@ -323,7 +364,8 @@ def health_check():
         "service": "Clinical Component Identifier (Few-Shot)",
         "version": "2.0",
         "model": "claude-sonnet-4-20250514",
-        "examples": len(FEW_SHOT_EXAMPLES)
+        "examples": len(FEW_SHOT_EXAMPLES),
+        "local_classifier": load_local_classifier() is not None
     })
 
 
@@ -341,21 +383,34 @@ def identify_components():
         if len(document_text) < 50:
             return jsonify({"error": "Text must be at least 50 characters long"}), 400
         
+        # Short snippets are classified locally; Claude is only used when the model is unsure
+        local_component = None
+        if data.get('allow_local', True) and len(document_text) <= LOCAL_CLASSIFIER_MAX_CHARS:
+            local_component = classify_locally(document_text)
+            if local_component and local_component["confidence"] >= LOCAL_CLASSIFIER_THRESHOLD:
+                return jsonify(local_classifier_response(local_component))
+        
         # Build the few-shot prompt
         prompt = build_few_shot_prompt(document_text)
         
         # Call Claude API
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=16000,
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            system="You are an expert at identifying reusable components in clinical trial documentation. You always respond with valid JSON arrays only."
-        )
+        try:
+            response = client.messages.create(
+                model="claude-sonnet-4-20250514",
+                max_tokens=16000,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                system="You are an expert at identifying reusable components in clinical trial documentation. You always respond with valid JSON arrays only."
+            )
+        except anthropic.APIConnectionError:
+            # API unreachable - a low-confidence local answer beats no answer
+            if local_component:
+                return jsonify(local_classifier_response(local_component, fallback=True))
+            raise
         
         # Parse response
         result_text = response.content[0].text.strip()
@@ -393,6 +448,9 @@ def identify_components():
             
             validated_components.append(validated_comp)
         
+        resolve_component_locations(build_document_index(document_text), validated_components)
+        record_components(validated_components)
+        
         return jsonify({
             "success": True,
             "components": validated_components,
@@ -466,9 +524,155 @@ def extract_text_from_pdf(file_path):
     return pages_data
 
 
+# ============================================
+# EXTRACTION CACHE
+# ============================================
+# Normalized PDF pages keyed by SHA-256 of the file bytes and EXTRACTOR_VERSION.
+# File layout: header (magic, format, page count), one (page, offset, length)
+# entry per page, then the UTF-8 text of all pages. Reads memory-map the file
+# and decode a page only when it is accessed.
+
+PAGE_STORE_MAGIC = b"CCPG"
+PAGE_STORE_FORMAT = 1
+_PAGE_STORE_HEADER = struct.Struct("<4sII")
+_PAGE_STORE_ENTRY = struct.Struct("<IQQ")
+
+_extraction_cache_lock = threading.Lock()
+
+
+class MappedPages(Sequence):
+    """Read-only list of {"page", "text"} dicts backed by a memory-mapped page store."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._count, self._blob_start = self._validate()
+        except (struct.error, ValueError):
+            self._mm.close()
+            raise ValueError(f"Corrupt page store: {path}")
+
+    def _validate(self):
+        """Check the header, that the pages tile the blob exactly, and that every page is valid UTF-8.
+
+        Pages are decoded one at a time and discarded, so a damaged store is
+        rejected here rather than when a page is first read.
+        """
+        size = len(self._mm)
+        magic, fmt, count = _PAGE_STORE_HEADER.unpack_from(self._mm, 0)
+        if magic != PAGE_STORE_MAGIC or fmt != PAGE_STORE_FORMAT:
+            raise ValueError("bad header")
+        blob_start = _PAGE_STORE_HEADER.size + count * _PAGE_STORE_ENTRY.size
+        if size < blob_start:
+            raise ValueError("truncated entry table")
+
+        expected_offset = 0
+        for i in range(count):
+            _, offset, length = _PAGE_STORE_ENTRY.unpack_from(self._mm, _PAGE_STORE_HEADER.size + i * _PAGE_STORE_ENTRY.size)
+            if offset != expected_offset:
+                raise ValueError("bad page offset")
+            expected_offset += length
+            start = blob_start + offset
+            self._mm[start:start + length].decode('utf-8')  # raises UnicodeDecodeError (a ValueError)
+        if size != blob_start + expected_offset:
+            raise ValueError("truncated page text")
+        return count, blob_start
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("page index out of range")
+        page, offset, length = _PAGE_STORE_ENTRY.unpack_from(self._mm, _PAGE_STORE_HEADER.size + index * _PAGE_STORE_ENTRY.size)
+        start = self._blob_start + offset
+        return {"page": page, "text": self._mm[start:start + length].decode('utf-8')}
+
+
+def file_sha256(file_path):
+    """Hash a file in 1MB blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_page_store(path, pages_data):
+    """Write pages_data to a page store file atomically."""
+    encoded = [p["text"].encode('utf-8') for p in pages_data]
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(_PAGE_STORE_HEADER.pack(PAGE_STORE_MAGIC, PAGE_STORE_FORMAT, len(pages_data)))
+            offset = 0
+            for p, data in zip(pages_data, encoded):
+                f.write(_PAGE_STORE_ENTRY.pack(p["page"], offset, len(data)))
+                offset += len(data)
+            for data in encoded:
+                f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def evict_extraction_cache():
+    """Delete least recently used page stores until the cache fits EXTRACTION_CACHE_MAX_BYTES."""
+    entries = []
+    for name in os.listdir(EXTRACTION_CACHE_DIR):
+        if name.endswith(".pages"):
+            stat = os.stat(os.path.join(EXTRACTION_CACHE_DIR, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= EXTRACTION_CACHE_MAX_BYTES:
+            break
+        try:
+            os.unlink(os.path.join(EXTRACTION_CACHE_DIR, name))
+            total -= size
+        except OSError:
+            # Still mapped by a request on Windows; try again on the next write
+            pass
+
+
+def extract_text_from_pdf_cached(file_path):
+    """Return normalized PDF pages from the extraction cache, extracting and storing them on a miss."""
+    key = f"{file_sha256(file_path)}-v{EXTRACTOR_VERSION}"
+    path = os.path.join(EXTRACTION_CACHE_DIR, f"{key}.pages")
+
+    if os.path.exists(path):
+        try:
+            pages_data = MappedPages(path)
+            os.utime(path)  # mark as recently used for eviction
+            return pages_data
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Error reading extraction cache: {str(e)}")
+            # Drop the bad entry so it is rewritten below instead of failing every upload
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    pages_data = extract_text_from_pdf(file_path)
+    try:
+        os.makedirs(EXTRACTION_CACHE_DIR, exist_ok=True)
+        with _extraction_cache_lock:
+            write_page_store(path, pages_data)
+            evict_extraction_cache()
+    except OSError as e:
+        print(f"Error writing extraction cache: {str(e)}")
+    return pages_data
+
+
 def extract_text_from_pdf_simple(file_path):
     """Extract text from PDF as a single string with page markers."""
-    pages_data = extract_text_from_pdf(file_path)
+    pages_data = extract_text_from_pdf_cached(file_path)
     text_parts = []
     for p in pages_data:
         text_parts.append(f"[PAGE {p['page']}]\n{p['text']}")
@@ -539,6 +743,7 @@ def upload_file():
             return jsonify({"error": "Extracted text is too short (less than 50 characters)"}), 400
         
         total_chars = len(document_text)
+        document_index = build_document_index(document_text)
         
         # Process document in chunks if it's very large
         # Each chunk should be around 25000 chars to leave room for prompt and response
@@ -548,49 +753,51 @@ def upload_file():
         
         if total_chars <= chunk_size:
             # Small document - process in one go
-            all_components = process_document_chunk(document_text, 0)
+            all_components = process_document_chunk(document_text, 0, document_index)
             chunks_processed = 1
         else:
             # Large document - process in chunks by page boundaries
             if pages_data:
                 # Split by pages for PDF
                 current_chunk = ""
-                current_start_page = 1
+                current_chunk_offset = 0
+                page_offset = 0
                 
                 for page_info in pages_data:
                     page_text = f"[PAGE {page_info['page']}]\n{page_info['text']}\n\n"
                     
                     if len(current_chunk) + len(page_text) > chunk_size and current_chunk:
                         # Process current chunk
-                        chunk_components = process_document_chunk(current_chunk, current_start_page - 1)
+                        chunk_components = process_document_chunk(current_chunk, current_chunk_offset, document_index)
                         all_components.extend(chunk_components)
                         chunks_processed += 1
                         
                         # Start new chunk
                         current_chunk = page_text
-                        current_start_page = page_info['page']
+                        current_chunk_offset = page_offset
                     else:
                         current_chunk += page_text
+                    page_offset += len(page_text)
                 
                 # Process final chunk
                 if current_chunk:
-                    chunk_components = process_document_chunk(current_chunk, current_start_page - 1)
+                    chunk_components = process_document_chunk(current_chunk, current_chunk_offset, document_index)
                     all_components.extend(chunk_components)
                     chunks_processed += 1
             else:
                 # Non-PDF - split by character count
                 for i in range(0, total_chars, chunk_size):
                     chunk = document_text[i:i + chunk_size]
-                    chunk_components = process_document_chunk(chunk, i)
+                    chunk_components = process_document_chunk(chunk, i, document_index)
                     all_components.extend(chunk_components)
                     chunks_processed += 1
         
         # Deduplicate components based on text similarity
         unique_components = deduplicate_components(all_components)
+        record_components(unique_components)
         
-        return jsonify({
-            "success": True,
-            "components": unique_components,
+        # Components stay server-side; the client pages through /api/results/<result_id>
+        summary = {
             "total_components": len(unique_components),
             "total_pages": len(pages_data) if pages_data else None,
             "model": "claude-sonnet-4-20250514",
@@ -599,7 +806,15 @@ def upload_file():
             "filename": file.filename,
             "text_length": total_chars,
             "chunks_processed": chunks_processed,
-            "truncated": False  # Never truncate anymore
+            "truncated": False,  # Never truncate anymore
+            **summarize_components(unique_components)
+        }
+        result_id = save_result(summary, unique_components)
+        
+        return jsonify({
+            "success": True,
+            "result_id": result_id,
+            **summary
         })
         
     except json.JSONDecodeError as e:
@@ -614,8 +829,396 @@ def upload_file():
         }), 500
 
 
-def process_document_chunk(chunk_text, chunk_offset=0):
-    """Process a single chunk of document text and return components."""
+# ============================================
+# RESULT STORAGE
+# ============================================
+# Upload results are stored server-side under a result id so the client can
+# page through them instead of receiving every component in one response.
+
+RESULT_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+RESULT_FIELDS = ["id", "type", "title", "text", "confidence", "reuse_potential", "rationale", "location"]
+
+_results_lock = threading.Lock()
+_results_cache = OrderedDict()
+
+
+def summarize_components(components):
+    """Count components by type and reuse potential for the upload summary."""
+    by_type = {}
+    by_reuse = {}
+    for comp in components:
+        by_type[comp["type"]] = by_type.get(comp["type"], 0) + 1
+        by_reuse[comp["reuse_potential"]] = by_reuse.get(comp["reuse_potential"], 0) + 1
+    return {"by_type": by_type, "by_reuse_potential": by_reuse}
+
+
+def save_result(summary, components):
+    """Store a result on disk and return its id. Oldest results beyond RESULTS_MAX_COUNT are removed."""
+    result_id = uuid.uuid4().hex
+    components = [dict(comp, id=i) for i, comp in enumerate(components)]
+    result = {"result_id": result_id, "summary": summary, "components": components}
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{result_id}.json")
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+    os.replace(path + ".tmp", path)
+
+    with _results_lock:
+        _results_cache[result_id] = result
+        while len(_results_cache) > RESULTS_CACHE_SIZE:
+            _results_cache.popitem(last=False)
+
+    prune_results()
+    return result_id
+
+
+def prune_results():
+    """Remove the oldest stored results beyond RESULTS_MAX_COUNT.
+
+    Best effort: other worker processes may prune the same files concurrently,
+    so files that disappear or cannot be removed are skipped.
+    """
+    stored = []
+    for name in os.listdir(RESULTS_DIR):
+        if not name.endswith(".json"):
+            continue
+        try:
+            stored.append((os.path.getmtime(os.path.join(RESULTS_DIR, name)), name))
+        except OSError:
+            continue
+
+    for _, name in sorted(stored)[:-RESULTS_MAX_COUNT]:
+        try:
+            os.unlink(os.path.join(RESULTS_DIR, name))
+        except OSError:
+            pass
+        with _results_lock:
+            _results_cache.pop(name[:-len(".json")], None)
+
+
+def load_result(result_id):
+    """Load a stored result by id, or return None if it does not exist."""
+    if not RESULT_ID_PATTERN.match(result_id):
+        return None
+
+    with _results_lock:
+        if result_id in _results_cache:
+            _results_cache.move_to_end(result_id)
+            return _results_cache[result_id]
+
+    path = os.path.join(RESULTS_DIR, f"{result_id}.json")
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+    except FileNotFoundError:
+        # Never stored, or pruned by another worker
+        return None
+
+    with _results_lock:
+        _results_cache[result_id] = result
+        while len(_results_cache) > RESULTS_CACHE_SIZE:
+            _results_cache.popitem(last=False)
+    return result
+
+
+def filter_components(components, types=None, reuse=None, start_page=None, end_page=None):
+    """Filter components by type, reuse potential and overlap with a document page range."""
+    matching = []
+    for comp in components:
+        if types and comp["type"] not in types:
+            continue
+        if reuse and comp["reuse_potential"] not in reuse:
+            continue
+        if start_page is not None or end_page is not None:
+            page = comp["location"].get("page")
+            if not isinstance(page, int):
+                continue
+            page_end = comp["location"].get("page_end") or page
+            if start_page is not None and page_end < start_page:
+                continue
+            if end_page is not None and page > end_page:
+                continue
+        matching.append(comp)
+    return matching
+
+
+def _gzip_stream(chunks):
+    """Gzip-compress a stream of byte chunks."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@app.route('/api/results/<result_id>', methods=['GET'])
+def get_result(result_id):
+    """Return stored components with pagination, filtering, field projection and gzip/NDJSON encoding.
+
+    Query parameters:
+        page, per_page          - pagination (per_page up to RESULTS_MAX_PER_PAGE)
+        type, reuse             - comma-separated component types / reuse potentials
+        start_page, end_page    - document page range
+        fields, exclude         - comma-separated fields to include / omit (e.g. exclude=text)
+        format                  - "json" (default) or "ndjson"; NDJSON streams every
+                                  matching component unless page/per_page are given
+    Responses are gzip-compressed when the client accepts gzip.
+    """
+    result = load_result(result_id)
+    if result is None:
+        return jsonify({"error": f"Result not found: {result_id}"}), 404
+
+    def list_arg(name):
+        value = request.args.get(name, '')
+        return [v.strip() for v in value.split(',') if v.strip()]
+
+    output_format = request.args.get('format', 'json')
+    if output_format not in ('json', 'ndjson'):
+        return jsonify({"error": "Unsupported format. Supported: json, ndjson"}), 400
+
+    try:
+        start_page = int(request.args['start_page']) if 'start_page' in request.args else None
+        end_page = int(request.args['end_page']) if 'end_page' in request.args else None
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', RESULTS_DEFAULT_PER_PAGE))
+    except ValueError:
+        return jsonify({"error": "page, per_page, start_page and end_page must be integers"}), 400
+    if page < 1 or per_page < 1:
+        return jsonify({"error": "page and per_page must be positive"}), 400
+    per_page = min(per_page, RESULTS_MAX_PER_PAGE)
+
+    fields = list_arg('fields') or RESULT_FIELDS
+    excluded = set(list_arg('exclude'))
+    fields = [f for f in fields if f in RESULT_FIELDS and f not in excluded]
+    if not fields:
+        return jsonify({"error": f"No valid fields selected. Allowed fields: {', '.join(RESULT_FIELDS)}"}), 400
+
+    matching = filter_components(
+        result["components"],
+        types=set(list_arg('type')),
+        reuse=set(list_arg('reuse')),
+        start_page=start_page,
+        end_page=end_page
+    )
+
+    paginate = output_format == 'json' or 'page' in request.args or 'per_page' in request.args
+    selected = matching[(page - 1) * per_page:page * per_page] if paginate else matching
+    projected = [{f: comp[f] for f in fields if f in comp} for comp in selected]
+
+    use_gzip = request.accept_encodings['gzip'] > 0
+
+    if output_format == 'ndjson':
+        chunks = (json.dumps(comp).encode('utf-8') + b"\n" for comp in projected)
+        response = Response(_gzip_stream(chunks) if use_gzip else chunks, mimetype='application/x-ndjson')
+        response.headers['X-Total-Matching'] = str(len(matching))
+    else:
+        body = json.dumps({
+            "success": True,
+            "result_id": result_id,
+            "components": projected,
+            "page": page,
+            "per_page": per_page,
+            "total_matching": len(matching),
+            "has_more": page * per_page < len(matching)
+        }).encode('utf-8')
+        if use_gzip and len(body) > 1024:
+            body = gzip.compress(body, compresslevel=6)
+        else:
+            use_gzip = False
+        response = Response(body, mimetype='application/json')
+
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+@app.route('/api/results/<result_id>/summary', methods=['GET'])
+def get_result_summary(result_id):
+    """Return the upload summary stored with a result."""
+    result = load_result(result_id)
+    if result is None:
+        return jsonify({"error": f"Result not found: {result_id}"}), 404
+    return jsonify(dict(result["summary"], success=True, result_id=result_id))
+
+
+# ============================================
+# POST-PROCESSING
+# ============================================
+# Page and section come from the document itself rather than from the model's
+# "location". Once per document we index the [PAGE X] markers, the section
+# headings and a whitespace-normalized copy of the text; each component is then
+# located by string search near its chunk and mapped to page/section with
+# binary search over the offset tables.
+
+PAGE_MARKER_PATTERN = re.compile(r"^\[PAGE (\d+)\]$", re.MULTILINE)
+SECTION_HEADING_PATTERN = re.compile(r"^(?:\d+(?: ?\.\d+)*\.? +[A-Z][^\n]{1,80}|[A-Z][A-Z0-9 ,&/()\-]{3,80})$", re.MULTILINE)
+SPAN_PROBE_CHARS = 60
+SPAN_MAX_CANDIDATES = 50  # prefix occurrences checked per search range
+SPAN_OVERLAP_RATIO = 0.8
+
+
+def build_document_index(document_text):
+    """Build the page-offset table, heading index and normalized text for a document."""
+    page_offsets = []
+    page_numbers = []
+    for m in PAGE_MARKER_PATTERN.finditer(document_text):
+        page_offsets.append(m.start())
+        page_numbers.append(int(m.group(1)))
+
+    heading_offsets = []
+    headings = []
+    for m in SECTION_HEADING_PATTERN.finditer(document_text):
+        heading = m.group(0).strip()
+        # Numbered list items look like headings; real headings are short and unpunctuated
+        if heading.endswith(('.', ',', ';', ':')) or len(heading.split()) > 12 or '....' in heading:
+            continue
+        heading_offsets.append(m.start())
+        headings.append(heading)
+
+    # Whitespace-collapsed copy of the text, with token offsets to map positions back
+    token_offsets = []
+    normalized_offsets = []
+    tokens = []
+    position = 0
+    for m in re.finditer(r"\S+", document_text):
+        token_offsets.append(m.start())
+        normalized_offsets.append(position)
+        tokens.append(m.group())
+        position += len(m.group()) + 1
+
+    return {
+        "page_offsets": page_offsets,
+        "page_numbers": page_numbers,
+        "heading_offsets": heading_offsets,
+        "headings": headings,
+        "token_offsets": token_offsets,
+        "normalized_offsets": normalized_offsets,
+        "normalized": " ".join(tokens)
+    }
+
+
+def _to_normalized(index, offset):
+    """Map an offset in the original text to the normalized text."""
+    i = bisect.bisect_left(index["token_offsets"], offset)
+    if i == len(index["token_offsets"]):
+        return len(index["normalized"])
+    return index["normalized_offsets"][i]
+
+
+def _to_original(index, offset):
+    """Map an offset in the normalized text back to the original text."""
+    i = max(bisect.bisect_right(index["normalized_offsets"], offset) - 1, 0)
+    return index["token_offsets"][i] + (offset - index["normalized_offsets"][i])
+
+
+def _lookup(offsets, values, position):
+    """Return the value of the last entry starting at or before position."""
+    i = bisect.bisect_right(offsets, position) - 1
+    return values[i] if i >= 0 else None
+
+
+def find_component_span(index, text, search_start=0, search_end=None):
+    """Find a component's (start, end) in the original text, or None if it cannot be located.
+
+    The search runs within [search_start, search_end) of the normalized text first
+    and falls back to the whole document. If the full text is not found verbatim
+    (e.g. a [PAGE X] marker was dropped), its first and last SPAN_PROBE_CHARS
+    characters bound the span. The prefix may be a running header that repeats on
+    every page, so the prefix occurrence whose span best matches the component's
+    length is used.
+    """
+    normalized = index["normalized"]
+    probe = " ".join(text.split())
+    if len(probe) < 20:
+        return None
+    if search_end is None:
+        search_end = len(normalized)
+
+    start = normalized.find(probe, search_start, search_end + len(probe))
+    if start == -1:
+        start = normalized.find(probe)
+    if start != -1:
+        end = start + len(probe)
+    else:
+        prefix = probe[:SPAN_PROBE_CHARS]
+        suffix = probe[-SPAN_PROBE_CHARS:]
+        start = None
+        first_prefix = None
+        for lo, hi in ((search_start, search_end + len(prefix)), (0, len(normalized))):
+            pos = normalized.find(prefix, lo, hi)
+            if first_prefix is None and pos != -1:
+                first_prefix = pos
+            for _ in range(SPAN_MAX_CANDIDATES):
+                if pos == -1:
+                    break
+                suffix_pos = normalized.find(suffix, pos, pos + 2 * len(probe))
+                if suffix_pos != -1:
+                    # The span may contain the prefix again (a repeated header), so of the
+                    # prefix occurrences before the suffix, take the one giving the span
+                    # length closest to the component's length
+                    end = suffix_pos + len(suffix)
+                    start = pos
+                    candidate = normalized.find(prefix, pos + 1, suffix_pos + len(prefix))
+                    while candidate != -1:
+                        if abs(end - candidate - len(probe)) < abs(end - start - len(probe)):
+                            start = candidate
+                        candidate = normalized.find(prefix, candidate + 1, suffix_pos + len(prefix))
+                    break
+                pos = normalized.find(prefix, pos + 1, hi)
+            if start is not None:
+                break
+        if start is None:
+            # Tail not found anywhere: keep the first prefix match with the probe's length
+            if first_prefix is None:
+                return None
+            start = first_prefix
+            end = min(start + len(probe), len(normalized))
+
+    return _to_original(index, start), _to_original(index, end - 1) + 1
+
+
+def resolve_component_locations(index, components, chunk_start=0, chunk_end=None):
+    """Replace each component's page and section with values resolved from the document.
+
+    chunk_start/chunk_end are the chunk's offsets in the document text and narrow
+    the search. Resolved locations gain page_end, char_start, char_end and the
+    chunk_start they came from; components that cannot be located keep the
+    model's location with resolved=False.
+    """
+    search_start = _to_normalized(index, chunk_start)
+    search_end = _to_normalized(index, chunk_end) if chunk_end is not None else None
+
+    for comp in components:
+        location = comp["location"]
+        span = find_component_span(index, comp["text"], search_start, search_end)
+        if span is None:
+            location["resolved"] = False
+            continue
+
+        start, end = span
+        if index["page_offsets"]:
+            location["page"] = _lookup(index["page_offsets"], index["page_numbers"], start)
+            location["page_end"] = _lookup(index["page_offsets"], index["page_numbers"], end - 1)
+        section = _lookup(index["heading_offsets"], index["headings"], start)
+        if section:
+            location["section"] = section
+        location["char_start"] = start
+        location["char_end"] = end
+        location["chunk_start"] = chunk_start
+        location["resolved"] = True
+
+    return components
+
+
+def process_document_chunk(chunk_text, chunk_offset=0, document_index=None):
+    """Process a single chunk of document text and return components.
+
+    chunk_offset is the chunk's character offset in the document; with a
+    document_index, component locations are resolved against the document.
+    """
     try:
         prompt = build_few_shot_prompt(chunk_text)
         
@@ -669,6 +1272,9 @@ Be thorough and comprehensive - extract every distinct reusable component you fi
             
             validated_components.append(validated_comp)
         
+        if document_index is not None:
+            resolve_component_locations(document_index, validated_components, chunk_offset, chunk_offset + len(chunk_text))
+        
         return validated_components
         
     except Exception as e:
@@ -677,24 +1283,322 @@ Be thorough and comprehensive - extract every distinct reusable component you fi
 
 
 def deduplicate_components(components):
-    """Remove duplicate components based on text similarity."""
+    """Remove duplicate components based on text similarity and spans repeated across chunks."""
     if not components:
         return []
     
     unique = []
     seen_texts = set()
+    kept_spans = []  # sorted (char_start, char_end, chunk_start) of resolved components
+    longest_span = 0
     
     for comp in components:
         # Create a normalized version of the text for comparison
         normalized = comp["text"].lower().strip()[:200]  # Compare first 200 chars
         
-        if normalized not in seen_texts:
-            seen_texts.add(normalized)
-            unique.append(comp)
+        if normalized in seen_texts:
+            continue
+        
+        # Neighbouring chunks can return the same passage with slightly different text.
+        # Spans from the same chunk may nest (a section and a definition inside it), so
+        # only spans from a different chunk count as duplicates.
+        location = comp.get("location") or {}
+        if location.get("resolved"):
+            start, end, chunk = location["char_start"], location["char_end"], location["chunk_start"]
+            j = bisect.bisect_left(kept_spans, (end,)) - 1
+            duplicate = False
+            while j >= 0 and kept_spans[j][0] + longest_span > start:
+                kept_start, kept_end, kept_chunk = kept_spans[j]
+                overlap = min(end, kept_end) - max(start, kept_start)
+                if kept_chunk != chunk and overlap >= SPAN_OVERLAP_RATIO * min(end - start, kept_end - kept_start):
+                    duplicate = True
+                    break
+                j -= 1
+            if duplicate:
+                continue
+            bisect.insort(kept_spans, (start, end, chunk))
+            longest_span = max(longest_span, end - start)
+        
+        seen_texts.add(normalized)
+        unique.append(comp)
     
     return unique
 
 
+# ============================================
+# LOCAL CLASSIFIER
+# ============================================
+# Hashed n-gram features with two linear softmax heads (component type and
+# reuse potential), trained from FEW_SHOT_EXAMPLES plus the components Claude
+# returned on earlier runs.
+
+LOCAL_CLASSIFIER_MODEL = "local-ngram-linear"
+CLASSIFIER_FEATURES = 2 ** 16
+REUSE_LABELS = ["high", "medium", "low"]
+
+_corpus_lock = threading.Lock()
+_corpus_keys = None  # normalized texts already in the corpus, loaded on first write
+_classifier_lock = threading.Lock()
+_classifier_cache = {"mtime": None, "model": None}
+
+
+def corpus_key(text):
+    """Normalized text used to deduplicate training examples."""
+    return text.lower().strip()[:200]
+
+
+def extract_hashed_features(text, n_features=CLASSIFIER_FEATURES):
+    """Hash word unigrams, word bigrams and character 4-grams into a sparse vector.
+
+    Returns (indices, values) with log-scaled counts, L2-normalized.
+    """
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    tokens = ["w:" + w for w in words]
+    tokens += ["b:" + a + " " + b for a, b in zip(words, words[1:])]
+    joined = " " + " ".join(words) + " "
+    tokens += ["c:" + joined[i:i + 4] for i in range(len(joined) - 3)]
+
+    hashes = np.fromiter((zlib.crc32(t.encode('utf-8')) for t in tokens), dtype=np.int64, count=len(tokens))
+    indices, counts = np.unique(hashes % n_features, return_counts=True)
+    values = np.log1p(counts).astype(np.float32)
+    norm = np.linalg.norm(values)
+    if norm > 0:
+        values /= norm
+    return indices, values
+
+
+def _train_softmax_head(features, labels, weights, n_classes, epochs=30, batch_size=256, learning_rate=0.5, l2=1e-5):
+    """Train a multinomial logistic regression head over sparse hashed features with AdaGrad."""
+    rng = np.random.default_rng(0)
+    W = np.zeros((CLASSIFIER_FEATURES, n_classes), dtype=np.float32)
+    b = np.zeros(n_classes, dtype=np.float32)
+    W_acc = np.full_like(W, 1e-8)
+    b_acc = np.full_like(b, 1e-8)
+    labels = np.asarray(labels)
+    weights = np.asarray(weights, dtype=np.float32)
+
+    for _ in range(epochs):
+        order = rng.permutation(len(features))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            indices = np.concatenate([features[i][0] for i in batch])
+            values = np.concatenate([features[i][1] for i in batch])
+            rows = np.repeat(np.arange(len(batch)), [len(features[i][0]) for i in batch])
+
+            # Sparse forward pass: logits[r] = sum(values * W[indices]) over row r
+            contrib = W[indices] * values[:, None]
+            logits = np.stack([np.bincount(rows, weights=contrib[:, k], minlength=len(batch)) for k in range(n_classes)], axis=1)
+            logits += b
+            logits -= logits.max(axis=1, keepdims=True)
+            probs = np.exp(logits)
+            probs /= probs.sum(axis=1, keepdims=True)
+
+            delta = probs
+            delta[np.arange(len(batch)), labels[batch]] -= 1.0
+            delta *= (weights[batch] / weights[batch].sum())[:, None]
+
+            # Scatter the gradient back onto the touched feature rows only
+            grad_contrib = delta[rows] * values[:, None]
+            touched = np.unique(indices)
+            grad_W = np.stack([np.bincount(indices, weights=grad_contrib[:, k], minlength=CLASSIFIER_FEATURES)[touched] for k in range(n_classes)], axis=1)
+            grad_W += l2 * W[touched]
+            grad_b = delta.sum(axis=0)
+
+            W_acc[touched] += grad_W ** 2
+            W[touched] -= learning_rate * grad_W / np.sqrt(W_acc[touched])
+            b_acc += grad_b ** 2
+            b -= learning_rate * grad_b / np.sqrt(b_acc)
+
+    return W, b
+
+
+def load_training_examples():
+    """Collect training examples from FEW_SHOT_EXAMPLES and the stored component corpus."""
+    type_labels = [t["name"] for t in TAXONOMY["component_types"]]
+    examples = []
+    seen_texts = set()
+
+    # Few-shot examples are hand-labelled, so they outweigh model output
+    for ex in FEW_SHOT_EXAMPLES:
+        examples.append((ex["text"], ex["type"], ex["reuse_potential"], 3.0))
+        seen_texts.add(corpus_key(ex["text"]))
+
+    if os.path.exists(COMPONENT_CORPUS_PATH):
+        with open(COMPONENT_CORPUS_PATH, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    comp = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                normalized = corpus_key(comp.get("text", ""))
+                if len(normalized) < 50 or normalized in seen_texts:
+                    continue
+                if comp.get("type") not in type_labels or comp.get("reuse_potential") not in REUSE_LABELS:
+                    continue
+                seen_texts.add(normalized)
+                examples.append((comp["text"], comp["type"], comp["reuse_potential"], float(comp.get("confidence", 0.8))))
+
+    return examples
+
+
+def train_local_classifier():
+    """Retrain the local classifier and save it to CLASSIFIER_MODEL_PATH."""
+    if not CLASSIFIER_SUPPORT:
+        raise Exception("Local classifier not available. Install numpy: pip install numpy")
+
+    type_labels = [t["name"] for t in TAXONOMY["component_types"]]
+    examples = load_training_examples()
+
+    # Snippets are capped at LOCAL_CLASSIFIER_MAX_CHARS at inference, so train on the same view
+    features = [extract_hashed_features(text[:LOCAL_CLASSIFIER_MAX_CHARS]) for text, _, _, _ in examples]
+    type_y = [type_labels.index(comp_type) for _, comp_type, _, _ in examples]
+    reuse_y = [REUSE_LABELS.index(reuse) for _, _, reuse, _ in examples]
+    sample_weights = [weight for _, _, _, weight in examples]
+
+    type_W, type_b = _train_softmax_head(features, type_y, sample_weights, len(type_labels))
+    reuse_W, reuse_b = _train_softmax_head(features, reuse_y, sample_weights, len(REUSE_LABELS))
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    tmp_path = CLASSIFIER_MODEL_PATH + ".tmp.npz"
+    np.savez_compressed(
+        tmp_path,
+        type_labels=np.array(type_labels),
+        reuse_labels=np.array(REUSE_LABELS),
+        type_weights=type_W,
+        type_bias=type_b,
+        reuse_weights=reuse_W,
+        reuse_bias=reuse_b,
+        n_examples=np.array(len(examples))
+    )
+    os.replace(tmp_path, CLASSIFIER_MODEL_PATH)
+
+    return len(examples)
+
+
+def load_local_classifier():
+    """Load the trained classifier, reloading it if the model file changed on disk."""
+    if not CLASSIFIER_SUPPORT or not os.path.exists(CLASSIFIER_MODEL_PATH):
+        return None
+
+    mtime = os.path.getmtime(CLASSIFIER_MODEL_PATH)
+    if _classifier_cache["mtime"] != mtime:
+        with np.load(CLASSIFIER_MODEL_PATH) as data:
+            _classifier_cache["model"] = {key: data[key] for key in data.files}
+        _classifier_cache["mtime"] = mtime
+
+    return _classifier_cache["model"]
+
+
+def classify_locally(text):
+    """Classify a snippet offline, training a first model if none exists.
+
+    Returns a component dict, or None if numpy is missing or training fails.
+    """
+    if not CLASSIFIER_SUPPORT:
+        return None
+
+    model = load_local_classifier()
+    if model is None:
+        with _classifier_lock:
+            if not os.path.exists(CLASSIFIER_MODEL_PATH):
+                try:
+                    train_local_classifier()
+                except OSError as e:
+                    print(f"Error training local classifier: {str(e)}")
+                    return None
+        model = load_local_classifier()
+        if model is None:
+            return None
+
+    indices, values = extract_hashed_features(text[:LOCAL_CLASSIFIER_MAX_CHARS])
+
+    def predict(weights, bias, labels):
+        logits = values @ weights[indices] + bias
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+        best = int(probs.argmax())
+        return str(labels[best]), float(probs[best])
+
+    comp_type, confidence = predict(model["type_weights"], model["type_bias"], model["type_labels"])
+    reuse_potential, _ = predict(model["reuse_weights"], model["reuse_bias"], model["reuse_labels"])
+
+    return {
+        "type": comp_type,
+        "title": f"{comp_type.replace('_', ' ').title()} Component",
+        "text": text,
+        "confidence": round(confidence, 4),
+        "reuse_potential": reuse_potential,
+        "rationale": f"Classified offline by the local n-gram model ({int(model['n_examples'])} training examples).",
+        "location": {
+            "page": None,
+            "section": None
+        }
+    }
+
+
+def local_classifier_response(component, fallback=False):
+    """Build the /api/identify response for a locally classified snippet."""
+    model = load_local_classifier()
+    return {
+        "success": True,
+        "components": [component],
+        "total_components": 1,
+        "model": LOCAL_CLASSIFIER_MODEL,
+        "method": "local-classifier",
+        "examples_used": int(model["n_examples"]),
+        "threshold": LOCAL_CLASSIFIER_THRESHOLD,
+        "fallback": fallback
+    }
+
+
+def _load_corpus_keys():
+    """Read the normalized texts already stored in the corpus."""
+    keys = {corpus_key(ex["text"]) for ex in FEW_SHOT_EXAMPLES}
+    if os.path.exists(COMPONENT_CORPUS_PATH):
+        with open(COMPONENT_CORPUS_PATH, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    keys.add(corpus_key(json.loads(line).get("text", "")))
+                except json.JSONDecodeError:
+                    continue
+    return keys
+
+
+def record_components(components):
+    """Append new components to the corpus used to retrain the local classifier.
+
+    Components already in the corpus (same normalized text) are skipped, and
+    nothing is added once it holds COMPONENT_CORPUS_MAX components.
+    """
+    global _corpus_keys
+    if not components:
+        return
+    try:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        with _corpus_lock:
+            if _corpus_keys is None:
+                _corpus_keys = _load_corpus_keys()
+            new_components = []
+            for comp in components:
+                key = corpus_key(comp["text"])
+                if key in _corpus_keys or len(_corpus_keys) >= COMPONENT_CORPUS_MAX + len(FEW_SHOT_EXAMPLES):
+                    continue
+                _corpus_keys.add(key)
+                new_components.append(comp)
+            if not new_components:
+                return
+            with open(COMPONENT_CORPUS_PATH, 'a', encoding='utf-8') as f:
+                for comp in new_components:
+                    f.write(json.dumps({
+                        "text": comp["text"],
+                        "type": comp["type"],
+                        "reuse_potential": comp["reuse_potential"],
+                        "confidence": comp["confidence"]
+                    }) + "\n")
+    except OSError as e:
+        print(f"Error recording components: {str(e)}")
+
+
 @app.route('/api/supported-formats', methods=['GET'])
 def get_supported_formats():
     """Return supported file formats."""
@@ -709,6 +1613,18 @@ def get_supported_formats():
 
 
 if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Clinical Component Identifier backend")
+    parser.add_argument('--train-classifier', action='store_true',
+                        help="Retrain the local classifier from the few-shot examples and stored components, then exit")
+    args = parser.parse_args()
+    
+    if args.train_classifier:
+        n_examples = train_local_classifier()
+        print(f"Local classifier trained on {n_examples} examples -> {CLASSIFIER_MODEL_PATH}")
+        raise SystemExit(0)
+    
     print("=" * 60)
     print("Clinical Component Identifier - Few-Shot Version")
     print("=" * 60)
@@ -717,6 +1633,7 @@ if __name__ == '__main__':
     print(f"Expected accuracy: 85-95%")
     print(f"PDF Support: {PDF_SUPPORT}")
     print(f"DOCX Support: {DOCX_SUPPORT}")
+    print(f"Local Classifier: {load_local_classifier() is not None} (threshold {LOCAL_CLASSIFIER_THRESHOLD})")
     print(f"Max File Size: 50MB")
     print("=" * 60)
     
@@ -0,0 +1,60 @@
+"""Benchmark span, page and section resolution on the GSK SAP sample.
+
+Usage (from backend/):
+    python benchmarks/bench_postprocessing.py [n_components]
+
+Builds the document index once, then resolves n_components (default 5000)
+passages sampled from the document. A third of them have altered
+whitespace and a fifth have a modified tail, so both the verbatim and the
+prefix/suffix search paths are exercised.
+"""
+
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+SAMPLE_PDF = os.path.join(os.path.dirname(__file__), "..", "..", "sample_data", "2014-002011-41-GSK_SAP.pdf")
+
+
+def main(n_components=5000):
+    document_text, _ = app.extract_text_from_pdf_simple(SAMPLE_PDF)
+
+    start = time.perf_counter()
+    index = app.build_document_index(document_text)
+    index_ms = (time.perf_counter() - start) * 1000
+
+    rng = random.Random(0)
+    paragraphs = [(m.start(), m.end()) for m in re.finditer(r"[^\n]{80,}", document_text)]
+    components = []
+    for i in range(n_components):
+        para_start, para_end = rng.choice(paragraphs)
+        text = document_text[para_start:para_end]
+        if i % 3 == 0:
+            text = text.replace(" ", "  ").replace(". ", ".\n")
+        if i % 5 == 0:
+            text = text[:-15] + " [truncated]"
+        components.append({"text": text, "location": {"page": None, "section": None}})
+
+    start = time.perf_counter()
+    app.resolve_component_locations(index, components)
+    resolve_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    unique = app.deduplicate_components(components)
+    dedupe_ms = (time.perf_counter() - start) * 1000
+
+    resolved = sum(comp["location"]["resolved"] for comp in components)
+    print(f"Document: {len(document_text):,} chars, {len(index['page_offsets'])} pages, {len(index['headings'])} headings")
+    print(f"Index build: {index_ms:.1f} ms")
+    print(f"Resolve: {n_components} components in {resolve_s * 1000:.0f} ms ({n_components / resolve_s:,.0f} components/s), {resolved} resolved")
+    print(f"Deduplicate: {len(unique)} unique in {dedupe_ms:.1f} ms")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,105 @@
+"""Tests for span, page and section resolution and cross-chunk deduplication."""
+
+import app
+
+HEADER = "ACME Pharma Statistical Analysis Plan Final Version 1.0 Date Issued 01FEB2016"
+
+
+def build_document(n_pages=8):
+    """Build page-marked text the way extract_text_from_pdf_simple does, with a running header."""
+    pages = []
+    for page in range(1, n_pages + 1):
+        pages.append(
+            f"[PAGE {page}]\n{HEADER}\n"
+            f"{page}. Section Number {page}\n"
+            f"Body text of page {page} describes assessment number {page} in enough detail to be unique.\n"
+            f"Closing paragraph of page {page} continues onto the next page with visit schedule {page}."
+        )
+    return "\n\n".join(pages)
+
+
+def make_component(text):
+    return {
+        "type": "procedure",
+        "title": "Test Component",
+        "text": text,
+        "confidence": 0.9,
+        "reuse_potential": "high",
+        "rationale": "",
+        "location": {"page": None, "section": None}
+    }
+
+
+def page_offset(document, page):
+    return document.index(f"[PAGE {page}]")
+
+
+def cross_page_passage(document):
+    """Page 5 from its running header through the start of page 6, with the [PAGE 6] marker dropped."""
+    start = document.index(HEADER, page_offset(document, 5))
+    end = document.index("unique.", page_offset(document, 6)) + len("unique.")
+    return document[start:end].replace("[PAGE 6]", "")
+
+
+def test_cross_page_span_without_marker_within_chunk():
+    document = build_document()
+    index = app.build_document_index(document)
+    text = cross_page_passage(document)
+    chunk_start, chunk_end = page_offset(document, 5), page_offset(document, 7)
+
+    [comp] = app.resolve_component_locations(index, [make_component(text)], chunk_start, chunk_end)
+
+    location = comp["location"]
+    assert location["resolved"] is True
+    assert (location["page"], location["page_end"]) == (5, 6)
+    assert document[location["char_start"]:].startswith(HEADER)
+    assert location["char_start"] == document.index(HEADER, chunk_start)
+
+
+def test_cross_page_span_without_marker_whole_document():
+    # The prefix is the running header, which first occurs on page 1
+    document = build_document()
+    index = app.build_document_index(document)
+
+    [comp] = app.resolve_component_locations(index, [make_component(cross_page_passage(document))])
+
+    assert (comp["location"]["page"], comp["location"]["page_end"]) == (5, 6)
+
+
+def test_nested_span_from_same_chunk_is_kept():
+    document = build_document()
+    index = app.build_document_index(document)
+    section_start = document.index("3. Section Number 3")
+    section_end = document.index("visit schedule 3.") + len("visit schedule 3.")
+    section = document[section_start:section_end]
+    nested = document[document.index("Body text of page 3"):document.index("unique.", section_start) + len("unique.")]
+
+    components = app.resolve_component_locations(index, [make_component(section), make_component(nested)], 0, len(document))
+
+    assert [comp["location"]["section"] for comp in components] == ["3. Section Number 3"] * 2
+    assert len(app.deduplicate_components(components)) == 2
+
+
+def test_overlapping_span_from_other_chunk_is_dropped():
+    document = build_document()
+    index = app.build_document_index(document)
+    passage_start = document.index("Body text of page 4")
+    passage = document[passage_start:document.index("visit schedule 4.") + len("visit schedule 4.")]
+    # Same passage returned by the next chunk with 10% of its tail cut off: >= 80% overlap
+    trimmed = passage[:int(len(passage) * 0.9)]
+    chunk_2_start = page_offset(document, 4)
+
+    first = app.resolve_component_locations(index, [make_component(passage)], 0, chunk_2_start + 50)
+    second = app.resolve_component_locations(index, [make_component(trimmed)], chunk_2_start, len(document))
+
+    unique = app.deduplicate_components(first + second)
+    assert unique == first
+
+
+def test_page_range_filter_matches_overlap():
+    document = build_document()
+    index = app.build_document_index(document)
+    [comp] = app.resolve_component_locations(index, [make_component(cross_page_passage(document))])
+
+    assert app.filter_components([comp], start_page=6, end_page=8) == [comp]
+    assert app.filter_components([comp], start_page=7, end_page=8) == []
@@ -2,6 +2,7 @@ import { useState, useRef } from 'react'
 import './App.css'
 
 const API_URL = 'http://localhost:5000'
+const RESULTS_PER_PAGE = 50
 
 // Sample clinical texts for testing
 const SAMPLE_TEXTS = [
@@ -74,6 +75,13 @@ function App() {
   const [dragActive, setDragActive] = useState(false)
   const [copiedIndex, setCopiedIndex] = useState(null)
   const [processingStatus, setProcessingStatus] = useState('')
+  const [resultId, setResultId] = useState(null)
+  const [resultPage, setResultPage] = useState(1)
+  const [hasMore, setHasMore] = useState(false)
+  const [totalMatching, setTotalMatching] = useState(null)
+  const [loadingMore, setLoadingMore] = useState(false)
+  const [typeFilter, setTypeFilter] = useState('')
+  const [reuseFilter, setReuseFilter] = useState('')
   const fileInputRef = useRef(null)
 
   const identifyFromText = async () => {
@@ -86,6 +94,9 @@ function App() {
     setError(null)
     setComponents([])
     setStats(null)
+    setResultId(null)
+    setHasMore(false)
+    setTotalMatching(null)
     setProcessingStatus('Analyzing text...')
 
     try {
@@ -138,6 +149,11 @@ function App() {
     setError(null)
     setComponents([])
     setStats(null)
+    setResultId(null)
+    setHasMore(false)
+    setTotalMatching(null)
+    setTypeFilter('')
+    setReuseFilter('')
     setProcessingStatus('Uploading file...')
 
     try {
@@ -163,7 +179,7 @@ function App() {
         throw new Error(data.error || 'Failed to process file')
       }
 
-      setComponents(data.components)
+      setResultId(data.result_id)
       setStats({
         total: data.total_components,
         totalPages: data.total_pages,
@@ -175,6 +191,9 @@ function App() {
         chunksProcessed: data.chunks_processed,
         truncated: false
       })
+
+      setProcessingStatus('Loading results...')
+      await fetchResultPage(data.result_id, 1, '', '')
     } catch (err) {
       if (err.name === 'AbortError') {
         setError('Request timed out. The file may be too large or complex. Please try a smaller file.')
@@ -187,6 +206,50 @@ function App() {
     }
   }
 
+  // Components of uploaded files stay on the server and are fetched one page at a time
+  const fetchResultPage = async (id, page, type, reuse) => {
+    const params = new URLSearchParams({ page, per_page: RESULTS_PER_PAGE })
+    if (type) params.set('type', type)
+    if (reuse) params.set('reuse', reuse)
+
+    const response = await fetch(`${API_URL}/api/results/${id}?${params}`)
+    const data = await response.json()
+
+    if (!response.ok) {
+      throw new Error(data.error || 'Failed to load results')
+    }
+
+    setComponents(prev => page === 1 ? data.components : [...prev, ...data.components])
+    setResultPage(page)
+    setHasMore(data.has_more)
+    setTotalMatching(data.total_matching)
+  }
+
+  const loadMoreResults = async () => {
+    setLoadingMore(true)
+    try {
+      await fetchResultPage(resultId, resultPage + 1, typeFilter, reuseFilter)
+    } catch (err) {
+      setError(err.message)
+    } finally {
+      setLoadingMore(false)
+    }
+  }
+
+  const applyFilters = async (type, reuse) => {
+    setTypeFilter(type)
+    setReuseFilter(reuse)
+    setExpandedComponent(null)
+    setLoadingMore(true)
+    try {
+      await fetchResultPage(resultId, 1, type, reuse)
+    } catch (err) {
+      setError(err.message)
+    } finally {
+      setLoadingMore(false)
+    }
+  }
+
   const handleIdentify = () => {
     if (activeTab === 'text') {
       identifyFromText()
@@ -201,6 +264,9 @@ function App() {
     setComponents([])
     setError(null)
     setStats(null)
+    setResultId(null)
+    setHasMore(false)
+    setTotalMatching(null)
   }
 
   const handleDrag = (e) => {
@@ -269,8 +335,24 @@ function App() {
     }
   }
 
-  const exportAllComponents = () => {
-    const exportData = components.map((comp, index) => ({
+  const exportAllComponents = async () => {
+    let allComponents = components
+    if (resultId) {
+      // Stream every stored component as NDJSON instead of only the loaded pages
+      try {
+        const response = await fetch(`${API_URL}/api/results/${resultId}?format=ndjson`)
+        if (!response.ok) {
+          throw new Error('Failed to export results')
+        }
+        const body = await response.text()
+        allComponents = body.split('\n').filter(line => line).map(line => JSON.parse(line))
+      } catch (err) {
+        setError(err.message)
+        return
+      }
+    }
+
+    const exportData = allComponents.map((comp, index) => ({
       id: index + 1,
       type: comp.type,
       title: comp.title,
@@ -452,12 +534,38 @@ function App() {
                 <div className="header-actions">
                   {stats && (
                     <span className="stats-badge">
-                      {stats.total} found
+                      {totalMatching !== null && totalMatching !== stats.total
+                        ? `${totalMatching} of ${stats.total} shown`
+                        : `${stats.total} found`}
                       {stats.totalPages && ` • ${stats.totalPages} pages`}
                       {stats.chunksProcessed && stats.chunksProcessed > 1 && ` • ${stats.chunksProcessed} chunks`}
                       {stats.filename && ` • ${stats.filename}`}
                     </span>
                   )}
+                  {resultId && (
+                    <>
+                      <select
+                        className="filter-select"
+                        value={typeFilter}
+                        onChange={(e) => applyFilters(e.target.value, reuseFilter)}
+                      >
+                        <option value="">All types</option>
+                        {Object.keys(TYPE_COLORS).map(type => (
+                          <option key={type} value={type}>{type.replace('_', ' ')}</option>
+                        ))}
+                      </select>
+                      <select
+                        className="filter-select"
+                        value={reuseFilter}
+                        onChange={(e) => applyFilters(typeFilter, e.target.value)}
+                      >
+                        <option value="">All reuse</option>
+                        <option value="high">Reuse: high</option>
+                        <option value="medium">Reuse: medium</option>
+                        <option value="low">Reuse: low</option>
+                      </select>
+                    </>
+                  )}
                   {components.length > 0 && (
                     <button className="export-button" onClick={exportAllComponents}>
                       <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2">
@@ -483,7 +591,7 @@ function App() {
                   </div>
                 )}
 
-                {!loading && !error && components.length === 0 && (
+                {!loading && !error && components.length === 0 && !resultId && (
                   <div className="empty-state">
                     <svg width="48" height="48" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="1.5">
                       <path d="M9 5H7a2 2 0 00-2 2v12a2 2 0 002 2h10a2 2 0 002-2V7a2 2 0 00-2-2h-2M9 5a2 2 0 002 2h2a2 2 0 002-2M9 5a2 2 0 012-2h2a2 2 0 012 2"></path>
@@ -496,6 +604,12 @@ function App() {
                   </div>
                 )}
 
+                {!loading && !loadingMore && resultId && components.length === 0 && (
+                  <div className="empty-state">
+                    <p>No components match the selected filters</p>
+                  </div>
+                )}
+
                 {components.map((comp, index) => {
                   const colors = TYPE_COLORS[comp.type] || TYPE_COLORS.study_section
                   const isExpanded = expandedComponent === index
@@ -503,7 +617,7 @@ function App() {
                   
                   return (
                     <div
-                      key={index}
+                      key={comp.id ?? index}
                       className={`component-card ${isExpanded ? 'expanded' : ''}`}
                       style={{ 
                         backgroundColor: colors.bg,
@@ -595,6 +709,14 @@ function App() {
                     </div>
                   )
                 })}
+
+                {hasMore && (
+                  <button className="load-more-button" onClick={loadMoreResults} disabled={loadingMore}>
+                    {loadingMore
+                      ? 'Loading...'
+                      : `Load more (${components.length} of ${totalMatching})`}
+                  </button>
+                )}
               </div>
             </div>
           </div>